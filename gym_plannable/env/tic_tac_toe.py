@@ -34,6 +34,10 @@ class TicTacToeState(PlannableStateDeterministic):
 
         return state
 
+    def _state_key(self):
+        # the board determines the winner and the rewards as well
+        return self.board.tobytes(), self._agent_turn
+
     @property
     def agent_turn(self):
         """
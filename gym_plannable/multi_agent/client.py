@@ -1,7 +1,7 @@
 import gymnasium as gym
 from .common import (
     StopServerException, ResetMessage, ObservationMessage,
-    StopServerMessage, ErrorMessage, ActionMessage
+    StopServerMessage, ErrorMessage, ActionMessage, SharedObservation
 )
 
 def handle_error_stop(client, error):
@@ -29,10 +29,23 @@ class AgentClientEnv(gym.Wrapper):
         self._ignore_multiple_reset = ignore_multiple_reset
         self._action_taken = True
         self._reset_obs = None
+        # whether the server was running the last time we checked: this
+        # is only re-checked once the server signals that it has stopped
+        self._server_running = False
+
+        if self.csi.shared_observations is None:
+            self._shared_obs = None
+        else:
+            self._shared_obs = self.csi.shared_observations[agentid]
+
+    def _check_running(self, method):
+        if not self.csi.started_event.is_set() or self.csi.stop_event.is_set():
+            raise StopServerException("Calling {} and the multi agent server is not running.".format(method))
+        self._server_running = True
 
     def reset(self):
-        if not self.csi.started_event.is_set() or self.csi.finished_event.is_set():
-            raise StopServerException("Calling reset and the multi agent server is not running.")
+        if not self._server_running:
+            self._check_running("reset")
 
         if self._ignore_multiple_reset and not self._action_taken:
             return self._reset_obs
@@ -41,36 +54,60 @@ class AgentClientEnv(gym.Wrapper):
         self.csi.incoming_messages.put(ResetMessage(self.agentid))
         obs_msg = self.csi.outgoing_messages[self.agentid].get()
 
-        if isinstance(obs_msg, ErrorMessage):
-            self.error_handler(self, obs_msg.msg)
-        elif isinstance(obs_msg, StopServerMessage):
-            raise StopServerException("The server has stopped.")
-        elif not isinstance(obs_msg, ObservationMessage):
-            self.error_handler(self, RuntimeError("The server returned: {}.".format(obs_msg)))
+        if type(obs_msg) is not ObservationMessage:
+            self._handle_unexpected(obs_msg)
+        elif type(obs_msg.observation) is SharedObservation:
+            obs_msg.observation = self._shared_obs.read()
+
+        obs, info = obs_msg.observation, obs_msg.info
+        self._recycle(obs_msg)
 
         if self._ignore_multiple_reset:
-            self._reset_obs = obs_msg.observation
+            self._reset_obs = obs
 
-        return obs_msg.observation, obs_msg.info
+        return obs, info
 
     def step(self, action):
-        if not self.csi.started_event.is_set() or self.csi.finished_event.is_set():
-            raise StopServerException("Calling step and the multi agent server is not running.")
+        if not self._server_running:
+            self._check_running("step")
 
         self.csi.incoming_messages.put(ActionMessage(action, self.agentid))
         obs_msg = self.csi.outgoing_messages[self.agentid].get()
 
-        if isinstance(obs_msg, ErrorMessage):
-            self.error_handler(self, obs_msg.msg)
-        elif isinstance(obs_msg, StopServerMessage):
-            raise StopServerException("The server has stopped.")
-        elif not isinstance(obs_msg, ObservationMessage):
-            self.error_handler(self, RuntimeError("The server returned: {}.".format(obs_msg)))
+        if type(obs_msg) is not ObservationMessage:
+            self._handle_unexpected(obs_msg)
+        elif type(obs_msg.observation) is SharedObservation:
+            obs_msg.observation = self._shared_obs.read()
 
         self._action_taken = True
-        return obs_msg.totuple()
+        ret = obs_msg.totuple()
+        self._recycle(obs_msg)
+        return ret
+
+    def _recycle(self, obs_msg):
+        """
+        Returns a consumed ObservationMessage to the server's pool
+        (in the in-process mode).
+        """
+        pools = self.csi.obs_msg_pools
+        if pools is not None:
+            pools[self.agentid].append(obs_msg)
+
+    def _handle_unexpected(self, msg):
+        """
+        Handles a message from the server that is not an ObservationMessage:
+        this is kept off the common path in reset() and step().
+        """
+        if isinstance(msg, ErrorMessage):
+            self.error_handler(self, msg.msg)
+        elif isinstance(msg, StopServerMessage):
+            self._server_running = False
+            raise StopServerException("The server has stopped.")
+        elif not isinstance(msg, ObservationMessage):
+            self.error_handler(self, RuntimeError("The server returned: {}.".format(msg)))
 
     def close(self):
+        self._server_running = False
         self.csi.stop()
 
     def __del__(self):
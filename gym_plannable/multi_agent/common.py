@@ -1,48 +1,82 @@
-from queue import Empty
-from multiprocessing.managers import RemoteError
-from multiprocessing import Manager
-
-class ManagerSingleton:
-    def __init__(self):
-        self.manager = None
-
-    def __call__(self):
-        if self.manager is None:
-            self.manager = Manager()
-        return self.manager
-
-manager_singleton = ManagerSingleton()
+import multiprocessing
+from multiprocessing import shared_memory
+import gymnasium as gym
+import numpy as np
+import threading
+import weakref
+import queue
 
 class ClientServerInterface:
     def __init__(self,
         num_agents,
         observation_spaces,
         action_spaces,
-        reward_ranges
+        reward_ranges,
+        in_process=False,
+        shared_observations=False
     ):
+        """
+        Arguments:
+        - in_process: If True, the server and all the clients are expected
+                      to live in the same process; thread-level queues and
+                      synchronization primitives are then used, so messages
+                      are never pickled.
+        - shared_observations: If True, observations from Box spaces are
+                      passed through shared memory instead of being pickled
+                      into the queues. Only possible if in_process is False:
+                      a ValueError is raised otherwise.
+        """
+        if shared_observations and in_process:
+            raise ValueError("Shared observations are only used between processes: in_process must be False.")
+
         self.observation_spaces = observation_spaces
         self.action_spaces = action_spaces
         self.reward_ranges = reward_ranges
-
-        manager = manager_singleton()
-        self.outgoing_messages = [manager.Queue() for _ in range(num_agents)]
-        self.incoming_messages = manager.Queue()
-        self.started_event = manager.Event()
-        self.finished_event = manager.Event()
-        self.stop_lock = manager.Lock()
+        self.in_process = in_process
+
+        if in_process:
+            # SimpleQueue is implemented in C and needs no condition variable
+            self.outgoing_messages = [queue.SimpleQueue() for _ in range(num_agents)]
+            self.incoming_messages = queue.SimpleQueue()
+            self.started_event = threading.Event()
+            self.finished_event = threading.Event()
+            self.stop_event = threading.Event()
+            self.stop_lock = threading.Lock()
+            # per-agent free lists of consumed ObservationMessages: the
+            # server pops from these, the clients put messages back once
+            # they have read them; this is only safe without pickling
+            self.obs_msg_pools = [[] for _ in range(num_agents)]
+        else:
+            # plain multiprocessing primitives rather than Manager proxies,
+            # which would make every call a round-trip to the manager
+            # process; like the queues, they are passed to the client
+            # processes when those are started
+            self.outgoing_messages = [multiprocessing.Queue() for _ in range(num_agents)]
+            self.incoming_messages = multiprocessing.Queue()
+            self.started_event = multiprocessing.Event()
+            self.finished_event = multiprocessing.Event()
+            self.stop_event = multiprocessing.Event()
+            self.stop_lock = multiprocessing.Lock()
+            self.obs_msg_pools = None
+
+        if shared_observations:
+            self.shared_observations = [
+                SharedObservationBuffer(space)
+                    if SharedObservationBuffer.supports(space) else None
+                for space in observation_spaces
+            ]
+        else:
+            self.shared_observations = None
 
     def _stop(self):
         if self.started_event.is_set() and not self.finished_event.is_set():
-            self.incoming_messages.put(StopServerMessage())
+            # the flag lets clients notice the stop before they send anything;
+            # the messages wake up the server and any client blocked on get()
+            self.stop_event.set()
+            self.incoming_messages.put(stop_server_message)
 
             for oq in self.outgoing_messages:
-                # clear away any existing message
-                try:
-                    oq.get_nowait()
-                except Empty:
-                    pass
-
-                oq.put_nowait(StopServerMessage())
+                oq.put_nowait(stop_server_message)
 
     def stop(self, wait=True):
         """
@@ -51,49 +85,144 @@ class ClientServerInterface:
         Arguments:
         - wait: If True, block until the server thread terminates.
         """
-
-        # note: things can fail if the other side has already disconnected
-        # from the manager: therefore the exceptions
-        try:
-            # if false, another thread is already stopping the server
-            if self.stop_lock.acquire(blocking=False):
-                try:
-                    self._stop()
-                except BaseException as e:
-                    self.stop_lock.release()
-                    raise e
-
-            if wait and self.started_event.is_set(): self.finished_event.wait()
-        
-        except FileNotFoundError:
-            pass
-        except RemoteError:
-            pass
+        # if false, another thread is already stopping the server; the flag
+        # is positional since threading and multiprocessing locks name it
+        # differently
+        if self.stop_lock.acquire(False):
+            try:
+                self._stop()
+            except BaseException as e:
+                self.stop_lock.release()
+                raise e
+
+        if wait and self.started_event.is_set(): self.finished_event.wait()
 
 class ResetMessage:
+    __slots__ = ('agentid',)
+
     def __init__(self, agentid):
         self.agentid = agentid
         
 class ResetAction:
-    pass
+    __slots__ = ()
+
+# stateless: the one instance is reused wherever a ResetAction is needed
+reset_action = ResetAction()
 
 class ActionMessage:
+    __slots__ = ('action', 'agentid')
+
     def __init__(self, action, agentid):
         self.action = action
         self.agentid = agentid
         
 class ObservationMessage:
+    __slots__ = ('observation', 'reward', 'terminated', 'truncated', 'info')
+
     def __init__(self, observation, reward=0, terminated=False, truncated=False, info=None):
+        self.set(observation, reward, terminated, truncated, info)
+
+    @classmethod
+    def from_legacy(cls, observation, reward=0, done=False, info=None):
+        """
+        Creates a message from the old Gym (observation, reward, done, info)
+        form: done is split into terminated and truncated according to
+        the 'TimeLimit.truncated' key of info.
+        """
+        truncated = bool(info) and info.get('TimeLimit.truncated', False)
+        return cls(observation, reward, done and not truncated, truncated, info)
+
+    def set(self, observation, reward=0, terminated=False, truncated=False, info=None):
+        """
+        Overwrites the contents of the message in place and returns it.
+        """
         self.observation = observation
         self.reward = reward
         self.terminated = terminated
         self.truncated = truncated
         self.info = info or {}
+        return self
 
     def totuple(self):
         return self.observation, self.reward, self.terminated, self.truncated, self.info
 
+    def __reduce_ex__(self, protocol):
+        # pickle the fields as constructor arguments, so that the field
+        # names are not pickled along with every message
+        return type(self), self.totuple()
+
+class SharedObservation:
+    """
+    Stands in for an observation that has been written into the agent's
+    SharedObservationBuffer.
+    """
+    __slots__ = ()
+
+class SharedObservationBuffer:
+    """
+    A block of shared memory holding the latest observation of one agent.
+
+    The server writes the observation in just before the message is put
+    into the agent's queue; since every agent has at most one observation
+    message in flight, the block is not overwritten before the client has
+    read it. The client copies the observation out so that it stays valid
+    after the next step.
+    """
+    def __init__(self, space):
+        self.shape = space.shape
+        self.dtype = np.dtype(space.dtype)
+        nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        # shared memory blocks cannot be empty
+        self.shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        self._finalizer = weakref.finalize(
+            self, SharedObservationBuffer._release, self.shm)
+
+    @staticmethod
+    def supports(space):
+        return isinstance(space, gym.spaces.Box)
+
+    @staticmethod
+    def _release(shm):
+        shm.close()
+        shm.unlink()
+
+    def __getstate__(self):
+        # the block is attached to by name in other processes; only the
+        # creating process unlinks it
+        return self.shape, self.dtype, self.shm.name
+
+    def __setstate__(self, state):
+        self.shape, self.dtype, name = state
+        self.shm = shared_memory.SharedMemory(name=name)
+        self._finalizer = weakref.finalize(self, self.shm.close)
+
+    def _view(self):
+        # not cached: a live view would keep the block from being closed
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    def write(self, observation):
+        """
+        Copies the observation into shared memory and returns the
+        placeholder to send instead of it. Observations that are not
+        arrays of the space's shape and dtype are returned unchanged,
+        to be sent in the message as usual.
+        """
+        if (
+            not isinstance(observation, np.ndarray) or
+            observation.shape != self.shape or
+            observation.dtype != self.dtype
+        ):
+            return observation
+
+        np.copyto(self._view(), observation)
+        return SharedObservation()
+
+    def read(self):
+        return self._view().copy()
+
 class ErrorMessage:
+    __slots__ = ('msg',)
+
     def __init__(self, msg):
         self.msg = msg
         
@@ -101,7 +230,11 @@ class ErrorException(Exception):
     pass
         
 class StopServerMessage:
-    pass
+    __slots__ = ()
+
+# stateless: the one instance is reused for every stop; in other processes
+# it unpickles into a new instance, which is dispatched by type all the same
+stop_server_message = StopServerMessage()
 
 class StopServerException(Exception):
     pass
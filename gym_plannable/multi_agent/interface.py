@@ -4,9 +4,26 @@ import weakref
 
 def multi_agent_to_single_agent(
     multi_agent_env, asynchronous=True,
-    return_server=False, ignore_multiple_reset=False
+    return_server=False, ignore_multiple_reset=False,
+    in_process=True, shared_observations=False
 ):
-    server = MultiAgentServer(multi_agent_env, asynchronous=asynchronous)
+    """
+    Starts a MultiAgentServer for the multi agent environment and returns
+    a single-agent client environment for each of its agents.
+
+    For an environment with a single agent, Multi2SingleWrapper calls the
+    environment directly, without a server thread and message queues.
+
+    Arguments:
+    - in_process: If True, the clients are used from the same process as
+                  the server and the messages are not pickled.
+    - shared_observations: If True, Box observations are passed through
+                  shared memory. This requires in_process=False; with the
+                  default in_process=True, a ValueError is raised.
+    """
+    server = MultiAgentServer(multi_agent_env, asynchronous=asynchronous,
+                              in_process=in_process,
+                              shared_observations=shared_observations)
     server.start()
     
     clients = [AgentClientEnv(weakref.proxy(multi_agent_env),
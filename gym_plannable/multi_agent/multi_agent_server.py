@@ -3,13 +3,30 @@ import threading
 from .common import (
     ClientServerInterface, ActionMessage, ResetMessage, ErrorMessage,
     StopServerMessage, StopServerException, ObservationMessage, ErrorException,
-    ResetAction
+    reset_action
 )
-import collections
+import weakref
 import numpy as np
 
+class _DrainMarker:
+    """
+    Marks the end of the messages that _drain() discards.
+    """
+    __slots__ = ()
+
+def _drain(q):
+    """
+    Discards the messages left in the queue. A marker is put in behind them
+    and messages are taken out until it comes back: a multiprocessing.Queue
+    passes its messages on in a feeder thread, so messages put into it
+    earlier may still be on their way when get_nowait() finds it empty.
+    """
+    q.put(_DrainMarker())
+    while not isinstance(q.get(), _DrainMarker): pass
+
 class MultiAgentServer:
-    def __init__(self, multi_agent_env, asynchronous=True):
+    def __init__(self, multi_agent_env, asynchronous=True, in_process=False,
+                 shared_observations=False):
         """
         A server that manages a multi agent environment, to which several
         clients may connect and present single-agent views of the environment
@@ -24,25 +41,45 @@ class MultiAgentServer:
                        and they are expected to query again at every step,
                        supplying None as an action. This way no environment
                        blocks for several time steps.
+        - in_process: If True, the clients are expected to run in the same
+                      process as the server (typically in other threads)
+                      and the messages are passed using thread-level queues.
+        - shared_observations: If True, observations from Box spaces are
+                      passed to the clients through shared memory rather
+                      than pickled; a ValueError is raised if in_process
+                      is also True.
         """
         self.multi_agent_env = multi_agent_env
+        # the number of agents is fixed: cached so that the hot paths
+        # do not have to go through the environment for it
+        self._num_agents = num_agents = multi_agent_env.num_agents
         
         self.csi = ClientServerInterface(
-            self.num_agents, multi_agent_env.observation_spaces,
-            multi_agent_env.action_spaces, multi_agent_env.reward_ranges
+            num_agents, multi_agent_env.observation_spaces,
+            multi_agent_env.action_spaces, multi_agent_env.reward_ranges,
+            in_process=in_process, shared_observations=shared_observations
         )
 
-        self.obs_msg_buffer = [None for _ in range(self.num_agents)]
-        self._reset_expected = np.ones(self.multi_agent_env.num_agents, dtype=bool)
-        self._reset_requested = np.zeros(self.multi_agent_env.num_agents, dtype=bool)
+        self.obs_msg_buffer = [None for _ in range(num_agents)]
+        # for clearing the per-agent lists in place
+        self._nones = (None,) * num_agents
+        # the last observations of the agents who were turning: see _filter_obs
+        self._filtered_obs = [None] * num_agents
+        self._reset_expected = np.ones(num_agents, dtype=bool)
+        self._reset_requested = np.zeros(num_agents, dtype=bool)
+        # scratch space for the newly done mask computed at every transition
+        self._newly_done_mask = np.empty(num_agents, dtype=bool)
 
         self._obs = None
         self._info = None
 
-        self._action_collector = ActionCollector(
-            self.multi_agent_env.num_agents, asynchronous=asynchronous
-        )
+        if asynchronous:
+            self._action_collector = ActionCollector(num_agents)
+        else:
+            self._action_collector = SyncActionCollector(num_agents)
 
+        # keyed by the exact message type; handlers for subclasses are
+        # resolved and added on first use: see _resolve_handler()
         self._message_handlers = {
             ActionMessage: self._handle_action,
             ResetMessage: self._handle_reset,
@@ -51,6 +88,15 @@ class MultiAgentServer:
         }
 
         self._thread = None
+        # the queues only need draining if the server has run before
+        self._has_run = False
+
+        # stop the server once it is garbage collected; the finalizer only
+        # references the interface, so it does not keep the server alive;
+        # a running server is kept alive by its thread and is stopped by
+        # stop() or by its clients
+        self._finalizer = weakref.finalize(self, self.csi.stop)
+        self._finalizer.atexit = False
         
     def stop(self, wait=True):
         self.csi.stop(wait=wait)
@@ -60,7 +106,7 @@ class MultiAgentServer:
         """
         Returns the number of agents in the managed multi agent environment.
         """
-        return self.multi_agent_env.num_agents
+        return self._num_agents
         
     def is_running(self):
         """
@@ -77,10 +123,8 @@ class MultiAgentServer:
         Arguments:
         - wait: If true, the call blocks until the server starts up.
         """
-        threading.Thread(
-            target=type(self).run,
-            args=(self,)
-        ).start()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.start()
 
         if wait:
             self.csi.started_event.wait()
@@ -90,131 +134,238 @@ class MultiAgentServer:
         The main server loop: meant to be run in a separate thread
         by calling start().
         """
-        self.csi.finished_event.clear()
+        csi = self.csi
+        incoming = csi.incoming_messages
+        self._prepare_run()
+        csi.started_event.set()
 
-        # make sure the message queues are clear; incoming
         try:
-            while True: self.csi.incoming_messages.get_nowait()
-        except Empty:
+            while True:
+                self._handle_messages(self._get_messages(incoming))
+        except StopServerException:
             pass
+        finally:
+            # set even if a handler raises, so that stop() never hangs
+            csi.finished_event.set()
+            csi.started_event.clear()
 
-        # make sure the message queues are clear; outgoing
-        for q in self.csi.outgoing_messages:
-            try:
-                while True: q.get_nowait()
-            except Empty:
-                pass
+        csi.stop_lock.release()
+
+    def _prepare_run(self):
+        """
+        Clears the events before the server starts; when the server is
+        started again, also clears the messages left over from the last run.
+        """
+        self.csi.finished_event.clear()
+        self.csi.stop_event.clear()
+
+        if self._has_run:
+            _drain(self.csi.incoming_messages)
+            for q in self.csi.outgoing_messages:
+                _drain(q)
+
+        self._has_run = True
+
+    def _handle_messages(self, msgs):
+        """
+        Passes each of the messages to its handler.
+        """
+        for msg in msgs:
+            handler = self._message_handlers.get(type(msg))
+
+            if handler is None:
+                handler = self._resolve_handler(type(msg))
+
+            handler(msg)
+
+    def _resolve_handler(self, msg_type):
+        """
+        Finds the handler for a subclass of one of the message types and
+        memoizes it, so that the next message of that type is dispatched
+        by a single dict lookup.
+
+        Raises:
+        - A ValueError if msg_type is not a message type.
+        """
+        for base_type, handler in list(self._message_handlers.items()):
+            if issubclass(msg_type, base_type):
+                self._message_handlers[msg_type] = handler
+                return handler
+
+        raise ValueError("Unexpected message type '{}'.".format(msg_type))
 
-        self.csi.started_event.set()
+    @staticmethod
+    def _get_messages(incoming):
+        """
+        Blocks until there is at least one incoming message and returns
+        a list of all the messages that are currently queued up, so that
+        bursts of messages are handled without blocking on each of them.
+        """
+        msgs = [incoming.get()]
 
         try:
-            while True:
-                msg = self.csi.incoming_messages.get()
-                
-                for msg_type, handler in self._message_handlers.items():
-                    if isinstance(msg, msg_type):
-                        handler(msg)
-                        break
-                else:
-                    raise ValueError("Unexpected message type '{}'.".format(type(msg)))
-        except StopServerException:
-            pass
-        except ReferenceError:
+            while True: msgs.append(incoming.get_nowait())
+        except Empty:
             pass
 
-        self.csi.finished_event.set()
-        self.csi.started_event.clear()
-        self.csi.stop_lock.release()
+        return msgs
 
     def _perform_transition(self):
         """
         Gets actions from the action collector and performs a step in the
         underlying environment or a reset (if an interrupt has been requested).
         """
-        action_dict = self._action_collector.get_actions()
-        actions = list(action_dict.values())
+        collector = self._action_collector
+        actions = collector.get_actions()
         
-        if self._action_collector.interrupted:
+        if collector.interrupted:
+            reset_expected = self._reset_expected
+            reset_requested = self._reset_requested
+            make_obs_msg = self._make_obs_msg
+            send_obs_msg = self._send_obs_msg
+            last_obs = self._obs
+            last_info = self._info
+            reset_requesters = collector.reset_requesters
+
             # make sure everybody knows that the episode ended
-            for agentid in range(self.num_agents):
+            for agentid in range(self._num_agents):
                 # the agents asking for an interrupt, and the agents who
                 # have been done before, already know
                 if (
-                    isinstance(action_dict.get(agentid, None), ResetMessage) or 
-                    self._reset_expected[agentid] or
-                    self._reset_requested[agentid]
+                    agentid in reset_requesters or
+                    reset_expected[agentid] or
+                    reset_requested[agentid]
                 ):
                     continue
 
-                # build up an observation message, repeating the last observation
-                if self._info is None:
+                # build up an observation message, repeating the last
+                # observation; the last info is only copied if non-empty
+                if last_info is None or not last_info[agentid]:
                     info = {'interrupted': True}
                 else:
-                    info = dict(self._info[agentid], interrupted=True)
+                    # a copy: in-process clients hold the env's dicts
+                    info = last_info[agentid].copy()
+                    info['interrupted'] = True
 
-                obs_msg = ObservationMessage(self._obs[agentid], 0, True, True, info)
-                self.csi.outgoing_messages[agentid].put_nowait(obs_msg)
+                obs_msg = make_obs_msg(agentid, last_obs[agentid], 0, True, True, info)
+                send_obs_msg(agentid, obs_msg)
 
             self._perform_reset()
             # if an agent is still waiting for a reset,
             # another reset is not expected
-            self._reset_expected[np.where(self._reset_requested)] = False
+            reset_expected[reset_requested] = False
 
             # prepare messages for everyone whose turn it is next
-            for agentid in self._action_collector.agent_turn:
-                obs_msg = ObservationMessage(self._obs[agentid])
+            obs = self._obs
+            obs_msg_buffer = self.obs_msg_buffer
+            for agentid in collector.agent_turn:
+                obs_msg = make_obs_msg(agentid, obs[agentid])
                 # if agent already requested a reset, send the message now
-                if self._reset_requested[agentid]:
-                    self.csi.outgoing_messages[agentid].put_nowait(obs_msg)
-                    self._reset_requested[agentid] = False
+                if reset_requested[agentid]:
+                    send_obs_msg(agentid, obs_msg)
+                    reset_requested[agentid] = False
                 else: # else buffer the message
-                    self.obs_msg_buffer[agentid] = obs_msg
+                    obs_msg_buffer[agentid] = obs_msg
                     
         else:
             try:
                 obs, rew, terminated, truncated, info = self.multi_agent_env.step(actions)
                 
             except BaseException as e:
-                for agentid in self._action_collector.agent_turn:
-                    self.csi.outgoing_messages[agentid].put_nowait(ErrorMessage(e))
+                outgoing = self.csi.outgoing_messages
+                for agentid in collector.agent_turn:
+                    outgoing[agentid].put_nowait(ErrorMessage(e))
                     
-                self._action_collector.reset(self._action_collector.agent_turn)
+                collector.reset(collector.agent_turn)
                 return
 
             self._obs = obs
             self._filter_obs()
             self._info = info
-            self._action_collector.reset(self.multi_agent_env.agent_turn)
-            
-            # signal all newly done agents
-            done = terminated | truncated
-            newly_done = np.where(~self._reset_expected & done)[0]
-
-            # communicate observations to the agents who are newly done
-            for agentid in newly_done:
-                obs_msg = ObservationMessage(obs[agentid], rew[agentid],
-                                             done[agentid], truncated[agentid],
-                                             info[agentid])
-                self.csi.outgoing_messages[agentid].put_nowait(obs_msg)
-
-            # keep track of which agents were done and should reset
-            self._reset_expected[np.where(done)] = True
-
-            # communicate observations to the agents who are turning now:
-            # unless they are in newly_done (those have been signaled already)
-
-            for agentid in set(self._action_collector.agent_turn).difference(newly_done):
-                obs_msg = ObservationMessage(obs[agentid], rew[agentid],
-                                             terminated[agentid], truncated[agentid],
-                                             info[agentid])
-
-                if self._reset_requested[agentid]:
-                    self._reset_requested[agentid] = False
-                elif self._reset_expected[agentid]:
-                    self.obs_msg_buffer[agentid] = obs_msg
-                    continue
+            collector.reset(self.multi_agent_env.agent_turn)
+            self._send_step_messages(obs, rew, terminated, truncated, info)
 
-                self.csi.outgoing_messages[agentid].put_nowait(obs_msg)
+    def _send_step_messages(self, obs, rew, terminated, truncated, info):
+        """
+        Does the book-keeping after a step of the underlying environment
+        and sends observations to the agents that are newly done and to
+        the agents whose turn it is now.
+
+        The per-agent flags are converted into lists once, so that the
+        per-agent branching does not index NumPy arrays element by element.
+        """
+        # signal all newly done agents
+        done = np.logical_or(terminated, truncated)
+        newly_done_mask = np.logical_not(self._reset_expected, out=self._newly_done_mask)
+        np.logical_and(newly_done_mask, done, out=newly_done_mask)
+        newly_done = np.flatnonzero(newly_done_mask).tolist()
+        is_newly_done = newly_done_mask.tolist()
+        done_list = done.tolist()
+
+        make_obs_msg = self._make_obs_msg
+        send_obs_msg = self._send_obs_msg
+
+        # communicate observations to the agents who are newly done
+        for agentid in newly_done:
+            obs_msg = make_obs_msg(agentid, obs[agentid], rew[agentid],
+                                   done_list[agentid], truncated[agentid],
+                                   info[agentid])
+            send_obs_msg(agentid, obs_msg)
+
+        # keep track of which agents were done and should reset
+        self._reset_expected |= done
+        reset_expected = self._reset_expected.tolist()
+        reset_requested = self._reset_requested.tolist()
+        obs_msg_buffer = self.obs_msg_buffer
+
+        # communicate observations to the agents who are turning now:
+        # unless they are in newly_done (those have been signaled already)
+
+        for agentid in self._action_collector.agent_turn:
+            if is_newly_done[agentid]: continue
+
+            obs_msg = make_obs_msg(agentid, obs[agentid], rew[agentid],
+                                   terminated[agentid], truncated[agentid],
+                                   info[agentid])
+
+            if reset_requested[agentid]:
+                self._reset_requested[agentid] = False
+            elif reset_expected[agentid]:
+                obs_msg_buffer[agentid] = obs_msg
+                continue
+
+            send_obs_msg(agentid, obs_msg)
+
+    def _make_obs_msg(self, agentid, observation, reward=0,
+                      terminated=False, truncated=False, info=None):
+        """
+        Returns an ObservationMessage for the specified agent. In the
+        in-process mode, messages already consumed by the agent's client
+        are reused instead of allocating new ones.
+        """
+        pools = self.csi.obs_msg_pools
+
+        if pools is not None and pools[agentid]:
+            return pools[agentid].pop().set(
+                observation, reward, terminated, truncated, info
+            )
+
+        return ObservationMessage(observation, reward, terminated, truncated, info)
+
+    def _send_obs_msg(self, agentid, obs_msg):
+        """
+        Puts an ObservationMessage into the agent's queue. If the agent's
+        observations go through shared memory, the observation is written
+        there only now, so that buffered messages do not overwrite the one
+        that the client may still be reading.
+        """
+        csi = self.csi
+        shared = csi.shared_observations
+
+        if shared is not None and shared[agentid] is not None:
+            obs_msg.observation = shared[agentid].write(obs_msg.observation)
+
+        csi.outgoing_messages[agentid].put_nowait(obs_msg)
 
     def _handle_action(self, msg):
         """
@@ -225,44 +376,49 @@ class MultiAgentServer:
         - A RuntimeError ErrorMessage is sent to the agent if an action is
           supplied before the agent has reset.
         """
-        if self._reset_expected[msg.agentid]:
-            e = RuntimeError("Agent {} did not call reset at the beginning of a new episode.".format(msg.agentid))
-            self.csi.outgoing_messages[msg.agentid].put_nowait(ErrorMessage(e))
+        agentid = msg.agentid
+        collector = self._action_collector
+
+        if self._reset_expected[agentid]:
+            e = RuntimeError("Agent {} did not call reset at the beginning of a new episode.".format(agentid))
+            self.csi.outgoing_messages[agentid].put_nowait(ErrorMessage(e))
             return
 
         # register the action message
         try:
-            self._action_collector.collect(msg)
+            collector.collect(msg)
         except ValueError as e:
-            self.csi.outgoing_messages[msg.agentid].put_nowait(ErrorMessage(e))
+            self.csi.outgoing_messages[agentid].put_nowait(ErrorMessage(e))
             return
 
         # if all actions collected, perform a transition
-        if self._action_collector.all_collected:
+        if collector.all_collected:
             self._perform_transition()
 
     def _perform_reset(self):
         """
         Resets the underlying environment and do the necessary book-keeping.
         """        
-        self._obs, self._info = self.multi_agent_env.reset()
-        self._action_collector.reset(self.multi_agent_env.agent_turn)
+        env = self.multi_agent_env
+        self._obs, self._info = env.reset()
+        self._action_collector.reset(env.agent_turn)
         self._filter_obs()
         self._reset_expected[:] = True
-        np.asarray(self.obs_msg_buffer)[:] = None
+        self.obs_msg_buffer[:] = self._nones
 
     def _filter_obs(self):
         orig_obs = self._obs
-        self._obs = [None for _ in range(self.num_agents)]
+        # the list is reused: the messages only take its items
+        obs = self._obs = self._filtered_obs
+        obs[:] = self._nones
 
         for agentid in self._action_collector.env_agent_turn:
-            self._obs[agentid] = orig_obs[agentid]
+            obs[agentid] = orig_obs[agentid]
 
     def _send_buffer_msg(self, agentid):
-        self.csi.outgoing_messages[agentid].put_nowait(
-            self.obs_msg_buffer[agentid]
-        )
-        self.obs_msg_buffer[agentid] = None
+        obs_msg_buffer = self.obs_msg_buffer
+        self._send_obs_msg(agentid, obs_msg_buffer[agentid])
+        obs_msg_buffer[agentid] = None
 
     def _has_buffer_msg(self, agentid):
         return not self.obs_msg_buffer[agentid] is None
@@ -273,41 +429,47 @@ class MultiAgentServer:
         the underlying environment, lodging an interrupt request, etc.
         """
 
+        agentid = msg.agentid
+        reset_expected = self._reset_expected
+        reset_requested = self._reset_requested
+
         # if all agents are done, reset the env
-        if np.all(self._reset_expected):
+        if np.all(reset_expected):
             # reset the env
             self._perform_reset()
-            self._reset_expected[msg.agentid] = False
+            reset_expected[agentid] = False
 
             # prepare messages for everyone whose turn it is next
-            for agentid in self._action_collector.agent_turn:
-                obs_msg = ObservationMessage(self._obs[agentid])
-                self.obs_msg_buffer[agentid] = obs_msg
+            obs = self._obs
+            obs_msg_buffer = self.obs_msg_buffer
+            make_obs_msg = self._make_obs_msg
+            for turn_agentid in self._action_collector.agent_turn:
+                obs_msg_buffer[turn_agentid] = make_obs_msg(turn_agentid, obs[turn_agentid])
 
             # send a buffered observation if any
-            if self._has_buffer_msg(msg.agentid):
-                self._send_buffer_msg(msg.agentid)
+            if self._has_buffer_msg(agentid):
+                self._send_buffer_msg(agentid)
             # or record a reset request to be redeemed later
             else:
-                self._reset_requested[msg.agentid] = True
+                reset_requested[agentid] = True
 
         # a regular reset after done
-        elif self._reset_expected[msg.agentid]:
-            self._reset_expected[msg.agentid] = False
+        elif reset_expected[agentid]:
+            reset_expected[agentid] = False
 
             # if there is already an observation for this agent lodged
             # in the observation buffer, send it now
-            if self._has_buffer_msg(msg.agentid):
-                self._send_buffer_msg(msg.agentid)
+            if self._has_buffer_msg(agentid):
+                self._send_buffer_msg(agentid)
 
             # if there is not, record the request: it is going to be redeemed
             # as soon as it is the agent's turn
             else:
-                self._reset_requested[msg.agentid] = True
+                reset_requested[agentid] = True
                 
         # lodge an interrupt request
         else:
-            self._reset_requested[msg.agentid] = True
+            reset_requested[agentid] = True
             self._handle_action(msg)
 
     def _handle_error(self, msg):
@@ -315,23 +477,37 @@ class MultiAgentServer:
         
     def _handle_stop(self, msg):
         raise StopServerException()
-        
-    def __del__(self):
-        self.stop()
 
 class ActionCollector:
-    def __init__(self, num_agents, agentids=[], asynchronous=True):
+    __slots__ = (
+        'num_agents', 'env_agent_turn', 'interrupted', 'reset_requesters',
+        '_all_agents', '_all_agents_set', '_received',
+        '_flat_actions', '_no_actions', '_flat_mode', '_actions', '_agent_turn', '_expected_count',
+        '_collected'
+    )
+
+    def __init__(self, num_agents, agentids=[]):
         """
         A class that, given a list of agents' ids, manages collecting
-        their actions (or requests to interrupt the episode).
+        their actions (or requests to interrupt the episode). For the
+        synchronous mode, see SyncActionCollector.
+
+        When all the agents are collected from, the actions are stored in
+        a flat list indexed by agent id instead of in a dictionary.
 
         Arguments:
         - agentids: A list containing ids of agents whose turn it is and their
                     actions are to be collected.
-        - asynchronous: If False, all agents are treated as if it were their turn.
         """
         self.num_agents = num_agents
-        self._asynchronous = asynchronous
+        self._all_agents = tuple(range(num_agents))
+        self._all_agents_set = frozenset(self._all_agents)
+        self._received = np.zeros(num_agents, dtype=bool)
+        # ids of the agents that asked for an interrupt
+        self.reset_requesters = set()
+        self.interrupted = False
+        self._flat_actions = [None] * num_agents
+        self._no_actions = (None,) * num_agents
         self.env_agent_turn = None
         self.reset(agentids)
         
@@ -340,14 +516,14 @@ class ActionCollector:
         """
         Returns True if all agents' actions have been collected.
         """
-        return self._collected == len(self._actions)
+        return self._collected == self._expected_count
 
     @property
     def agent_turn(self):
         """
         Returns a view of agent ids for agents whose turn it currently is.
         """
-        return self._actions.keys()
+        return self._agent_turn
     
     def collect(self, msg):
         """
@@ -363,37 +539,56 @@ class ActionCollector:
         - A TypeError if msg is neither an ActionMessage, nor a ResetMessage.
         """
         agentid = msg.agentid
-        
-        try:
-            if not self._actions[agentid] is None:
+
+        if self._flat_mode:
+            if not agentid in self._all_agents_set:
+                raise ValueError("It is currently not agent {}'s turn.".format(agentid))
+            if self._received[agentid]:
                 raise ValueError("An action has already been collected for agent {}.".format(agentid))
-        except KeyError:
-            raise ValueError("It is currently not agent {}'s turn.".format(agentid))
+        else:
+            try:
+                if not self._actions[agentid] is None:
+                    raise ValueError("An action has already been collected for agent {}.".format(agentid))
+            except KeyError:
+                raise ValueError("It is currently not agent {}'s turn.".format(agentid))
             
         if isinstance(msg, ActionMessage):
-            if not self._asynchronous and not agentid in self.env_agent_turn:
-                raise ValueError("It is currently not agent {}'s turn: None was expected instead of an action.".format(agentid))
-            self._actions[agentid] = msg.action
+            action = msg.action
         elif isinstance(msg, ResetMessage):
-            self._actions[agentid] = ResetAction()
+            action = reset_action
             self.interrupted = True
+            self.reset_requesters.add(agentid)
         else:
             raise TypeError("Unexpected message type '{}'.".format(type(msg)))
+
+        self._actions[agentid] = action
+        if self._flat_mode: self._received[agentid] = True
         
         self._collected += 1
+
+    def requested_reset(self, agentid):
+        """
+        Returns True if the agent has asked for the episode to be
+        interrupted instead of supplying an action.
+        """
+        return agentid in self.reset_requesters
     
     def get_actions(self):
         """
-        Returns a view of the collected actions in the order the agentids
-        were specified.
+        Returns a new list of the collected actions in the order the
+        agentids were specified.
 
         Raises:
         - A RuntimeError if all actions have not yet been collected.
         """
         if not self.all_collected:
             raise RuntimeError("Actions not yet collected for all agentids.")
+        elif self._flat_mode:
+            # a copy: the flat list is reused by the next reset(), while
+            # the environment may keep the actions it is given
+            return list(self._actions)
         else:
-            return self._actions
+            return list(self._actions.values())
         
     def reset(self, agentids=[]):
         """
@@ -404,12 +599,80 @@ class ActionCollector:
         - agentids: A list containing ids of agents whose turn it is and their
                     actions are to be collected.
         """
-        if self._asynchronous:
-            self._actions = collections.OrderedDict.fromkeys(agentids)
-            self.env_agent_turn = self._actions.keys()
+        self._flat_mode = tuple(agentids) == self._all_agents
+
+        if self._flat_mode:
+            # the flat list is reused rather than reallocated
+            self._flat_actions[:] = self._no_actions
+            self._actions = self._flat_actions
+            self._received.fill(False)
+            self._agent_turn = self._all_agents
         else:
-            self._actions = collections.OrderedDict.fromkeys(range(self.num_agents))
-            self.env_agent_turn = set(agentids)
-        
+            # a new dict every time: agentids may well be the keys view
+            # of the current one (see MultiAgentServer._perform_transition);
+            # dicts keep the insertion order
+            self._actions = dict.fromkeys(agentids)
+            self._agent_turn = self._actions.keys()
+
+        self.env_agent_turn = self._agent_turn
+        self._expected_count = len(self._agent_turn)
+        self._collected = 0
+        if self.interrupted: self.reset_requesters.clear()
+        self.interrupted = False
+
+class SyncActionCollector(ActionCollector):
+    """
+    An ActionCollector for the synchronous mode, where all agents are
+    treated as if it were their turn: a message is collected from every
+    agent at every step, but only the agents whose turn it is in the
+    environment may supply an action. The actions always go into the
+    flat list, so collect() and reset() skip the dict mode checks.
+    """
+    __slots__ = ()
+
+    def collect(self, msg):
+        """
+        Registers an agent's action (given an ActionMessage) or an agent's
+        request for the episode to be interrupted (given a ResetMessage).
+
+        Raises:
+        - A ValueError if the agent's action has already been collected;
+        - A ValueError if it is not the agent's turn in the environment;
+        - A TypeError if msg is neither an ActionMessage, nor a ResetMessage.
+        """
+        agentid = msg.agentid
+
+        if not agentid in self._all_agents_set:
+            raise ValueError("It is currently not agent {}'s turn.".format(agentid))
+        if self._received[agentid]:
+            raise ValueError("An action has already been collected for agent {}.".format(agentid))
+
+        if isinstance(msg, ActionMessage):
+            if not agentid in self.env_agent_turn:
+                raise ValueError("It is currently not agent {}'s turn: None was expected instead of an action.".format(agentid))
+            self._actions[agentid] = msg.action
+        elif isinstance(msg, ResetMessage):
+            self._actions[agentid] = reset_action
+            self.interrupted = True
+            self.reset_requesters.add(agentid)
+        else:
+            raise TypeError("Unexpected message type '{}'.".format(type(msg)))
+
+        self._received[agentid] = True
+        self._collected += 1
+
+    def reset(self, agentids=[]):
+        """
+        Resets action collection; actions are again collected from all
+        agents, agentids are the ones whose turn it is in the environment.
+        """
+        self._flat_mode = True
+        self._flat_actions[:] = self._no_actions
+        self._actions = self._flat_actions
+        self._received.fill(False)
+        self._agent_turn = self._all_agents
+        self.env_agent_turn = set(agentids)
+        self._expected_count = self.num_agents
         self._collected = 0
+        if self.interrupted: self.reset_requesters.clear()
         self.interrupted = False
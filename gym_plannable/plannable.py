@@ -18,10 +18,49 @@ class SamplePlannableState(State):
         super().__init__(observation_spaces, action_spaces, reward_ranges)
 
         if score_tracker is None:
-            self.score_tracker = ScoreTrackerTotal()
+            self.score_tracker = ScoreTrackerTotal(len(observation_spaces))
         else:
             self.score_tracker = score_tracker
 
+    # the legal actions are computed once per state: see legal_actions()
+    _legal_actions_cache = None
+
+    def __getstate__(self):
+        # copies are about to be modified: the cache is not carried over
+        state = self.__dict__.copy()
+        state.pop('_legal_actions_cache', None)
+        return state
+
+    def _state_key(self):
+        """
+        Returns a hashable key identifying the state, so that equal states
+        reached along different paths can be recognized, e.g. by the
+        transposition tables of a search. The key should cover everything
+        that distinguishes the states, such as the board and whose turn
+        it is.
+
+        By default, this returns None and states are compared by identity.
+        """
+        return None
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+
+        if type(self) is not type(other):
+            return NotImplemented
+
+        key = self._state_key()
+        return not key is None and key == other._state_key()
+
+    def __hash__(self):
+        key = self._state_key()
+
+        if key is None:
+            return object.__hash__(self)
+
+        return hash(key)
+
     def _select_who(self, seq, who, make_array=False):
         """
         Filters an input sequence that contains one item for each
@@ -38,6 +77,8 @@ class SamplePlannableState(State):
             if make_array: seq = np.asarray(seq)
             return seq
         elif who == "turn":
+            # arrays are indexed by the whole agent_turn at once
+            if isinstance(seq, np.ndarray): return seq[list(self.agent_turn)]
             seq = [seq[a] for a in self.agent_turn]
             if make_array: seq = np.asarray(seq)
             return seq
@@ -67,11 +108,6 @@ class SamplePlannableState(State):
         
         return self._select_who(scores, who)
 
-    @staticmethod
-    def _make_state(state):
-        state.score_tracker.update_scores(state.rewards())
-        return state
-
     @abc.abstractmethod
     def _next(self, actions, *args, inplace=False, **kwargs):
         """
@@ -90,7 +126,23 @@ class SamplePlannableState(State):
             * inplace: If inplace is true, the state should be modified in place
                        and self should be returned.
         """
-        return self._make_state(self._next(actions, *args, inplace=inplace, **kwargs))
+        state = self._next(actions, *args, inplace=inplace, **kwargs)
+        state._legal_actions_cache = None
+        state.score_tracker.update_scores(state.rewards())
+        return state
+
+    def next_batch(self, actions_batch, *args, **kwargs):
+        """
+        Returns a list of next states, one for each item of actions_batch;
+        each is computed as by next() from this state, which is left
+        unchanged. Subclasses whose transitions can be vectorized may
+        override this to compute the whole batch at once.
+
+        Arguments:
+            * actions_batch: A sequence of the agents' actions, each item
+                             as would be passed to next().
+        """
+        return [self.next(actions, *args, **kwargs) for actions in actions_batch]
 
     @abc.abstractmethod
     def _init(self, inplace=False):
@@ -111,7 +163,9 @@ class SamplePlannableState(State):
             * inplace: If inplace is true, the state should be modified in place
                        and self should be returned.
         """
-        return self._init(inplace=inplace)
+        state = self._init(inplace=inplace)
+        state._legal_actions_cache = None
+        return state
 
     @abc.abstractmethod
     def _legal_actions(self):
@@ -124,6 +178,12 @@ class SamplePlannableState(State):
         """
         Returns the sequence of all actions that are legal in the state for each agent.
 
+        The sequence is computed once and cached until the state is changed
+        by next() or init(); a state modified in any other way needs to reset
+        _legal_actions_cache to None. The returned list is a copy, but the
+        per-agent items are shared with the cache and must not be modified
+        in place.
+
         Arguments:
             - who ("all", "turn", "single"): If "all", this returns a list with
               an item for each agent in the environment; if "turn", this returns
@@ -131,7 +191,14 @@ class SamplePlannableState(State):
               this asserts that there is a single turning agent and returns
               its corresponding item.
         """
-        return self._select_who(self._legal_actions(), who)
+        legal_actions = self._legal_actions_cache
+
+        if legal_actions is None:
+            legal_actions = self._legal_actions_cache = self._legal_actions()
+
+        # the cached list itself is never handed out
+        if who == "all": return list(legal_actions)
+        return self._select_who(legal_actions, who)
 
     @abc.abstractmethod
     def _is_done(self):
@@ -227,15 +294,49 @@ class PlannableState(SamplePlannableState):
         """
         raise NotImplementedError()
     
-    def all_next(self, actions, *args, **kwargs):
+    def all_next(self, actions, *args, track_scores=True, **kwargs):
         """
         Returns a generator of (state, probability) tuples for all possible
         next states.
 
-        In the background, scores are tracked.
+        Arguments:
+            * track_scores: If true, scores are tracked in the background,
+                            as in next(). Search code that only needs the
+                            probabilities and the rewards can pass False
+                            to skip updating a score tracker for every
+                            next state.
+        """
+        for ns, prob in self._all_next(actions, *args, **kwargs):
+            ns._legal_actions_cache = None
+            if track_scores: ns.score_tracker.update_scores(ns.rewards())
+            yield ns, prob
+
+    def all_next_batch(self, actions, *args, **kwargs):
+        """
+        Returns all possible next states together with NumPy arrays that
+        allow computations over them (such as expected values) to be
+        vectorized.
+
+        Returns a (states, probs, rewards, done) tuple: a list of the K
+        next states, an array of shape (K,) with their probabilities and
+        arrays of shape (K, num_agents) with their rewards and done flags.
         """
-        return ((self._make_state(ns), prob)
-            for (ns, prob) in self._all_next(actions, *args, **kwargs))
+        states = []
+        probs = []
+
+        for ns, prob in self.all_next(actions, *args, **kwargs):
+            states.append(ns)
+            probs.append(prob)
+
+        num_agents = self.num_agents
+        rewards = np.empty((len(states), num_agents))
+        done = np.empty((len(states), num_agents), dtype=bool)
+
+        for i, ns in enumerate(states):
+            rewards[i] = ns.rewards()
+            done[i] = ns.is_done()
+
+        return states, np.asarray(probs, dtype=float), rewards, done
 
     @abc.abstractmethod
     def _all_init(self):
@@ -257,7 +358,8 @@ class PlannableStateDeterministic(PlannableState):
         return ((self.init(), 1.0) for i in range(1))
 
     def _all_next(self, actions, *args, **kwargs):
-        return ((self.next(actions, *args, **kwargs), 1.0) for i in range(1))
+        # _next rather than next: all_next tracks the scores
+        return ((self._next(actions, *args, **kwargs), 1.0) for i in range(1))
 
 class SamplePlannableEnv:
     @abc.abstractmethod
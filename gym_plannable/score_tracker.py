@@ -1,3 +1,4 @@
+import numpy as np
 import abc
 
 class ScoreTracker:
@@ -11,11 +12,25 @@ class ScoreTracker:
         raise NotImplementedError()
 
 class ScoreTrackerTotal(ScoreTracker):
-    def __init__(self):
-        self._scores = 0
+    def __init__(self, num_agents=None):
+        """
+        Tracks the total sum of rewards for each agent.
+
+        Arguments:
+            num_agents: If given, the scores are preallocated and the rewards
+                        are added to them in place; otherwise the scores are
+                        0 until the first update.
+        """
+        if num_agents is None:
+            self._scores = 0
+        else:
+            self._scores = np.zeros(num_agents)
 
     def update_scores(self, rewards):
-        self._scores += rewards
+        if isinstance(self._scores, np.ndarray):
+            np.add(self._scores, rewards, out=self._scores)
+        else:
+            self._scores = self._scores + np.asarray(rewards)
 
     @property
     def scores(self):
@@ -13,9 +13,20 @@ class DummyEnvTurnBased(MultiAgentEnv):
         self.exception_at = exception_at
         self.num_steps = num_steps
 
+        # the terminated flags are returned without copying: read-only
+        self._not_terminated = np.zeros(self.num_agents, dtype=bool)
+        self._not_terminated.setflags(write=False)
+        self._terminated = np.ones(self.num_agents, dtype=bool)
+        self._terminated.setflags(write=False)
+        # reused by every step: the rewards returned by a step are only
+        # valid until the next one
+        self._rewards = np.zeros(self.num_agents)
+        # one agent turns at a time: the turns are built once
+        self._agent_turns = tuple((agentid,) for agentid in range(self.num_agents))
+
     @property
     def agent_turn(self):
-        return [self._step % self.num_agents]
+        return self._agent_turns[self._step % self.num_agents]
 
     def reset(self):
         self._step = 0
@@ -37,16 +48,36 @@ class DummyEnvTurnBased(MultiAgentEnv):
             raise RuntimeError("Raising a planned exception at step {}.".format(self._step))
 
         obs = [self._step % self.num_agents for i in range(self.num_agents)]
-        rewards = np.zeros(self.num_agents)
+        rewards = self._rewards
+        rewards.fill(0.0)
         rewards[agentid] = action
         info = [{} for i in range(self.num_agents)]
         truncated = [False for i in range(self.num_agents)]
 
         if self._step < self.num_steps:
-            terminated = np.zeros(self.num_agents, dtype=bool)
+            terminated = self._not_terminated
         else:
-            terminated = np.ones(self.num_agents, dtype=bool)
+            terminated = self._terminated
 
         self._step += 1
 
         return obs, rewards, terminated, truncated, info
+
+class DummyEnvCounting(DummyEnvTurnBased):
+    """
+    Like DummyEnvTurnBased, but the observations, rewards and infos
+    record the step and the agent they were produced for.
+    """
+    def reset(self):
+        obs, info = super().reset()
+        return (
+            [0 for i in range(self.num_agents)],
+            [{'step': 0, 'agentid': i} for i in range(self.num_agents)]
+        )
+
+    def step(self, actions):
+        obs, rewards, terminated, truncated, info = super().step(actions)
+        obs = [self._step for i in range(self.num_agents)]
+        rewards = [10 * self._step + i for i in range(self.num_agents)]
+        info = [{'step': self._step, 'agentid': i} for i in range(self.num_agents)]
+        return obs, rewards, terminated, truncated, info
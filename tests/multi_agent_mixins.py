@@ -6,7 +6,25 @@ from gym_plannable.multi_agent import (
 
 import gc
 import weakref
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+def run_concurrently(executor, agents, stop):
+    """
+    Runs the agents in the executor and waits for all of them; errors,
+    including failed assertions, are re-raised in the calling thread.
+    Once an agent fails, stop() is called first, so that the agents left
+    waiting for the server are woken up.
+    """
+    futures = [executor.submit(agent) for agent in agents]
+    done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+
+    for future in done:
+        error = future.exception()
+        if not error is None:
+            stop()
+            raise error
+
+    for future in futures: future.result()
 
 class EnvTestMixin:
     env_constructor = None
@@ -38,9 +56,9 @@ class EnvTestMixin:
         self.assertEqual(len(obs), self.env.num_agents)
         self.assertEqual(len(infos), self.env.num_agents)
 
-        for io, o in enumerate(obs):
+        for space, o in zip(self.env.observation_spaces, obs):
             self.assertTrue(
-                self.env.observation_spaces[io].contains(o),
+                space.contains(o),
                 "Returned observation is not contained in the observation space."
             )
 
@@ -51,25 +69,31 @@ class EnvTestMixin:
         self.env.reset()
         agent_turn = self.env.agent_turn
 
-        actions = [self.env.action_spaces[agentid].sample()
-                for agentid in agent_turn]
+        action_spaces = self.env.action_spaces
+        actions = [action_spaces[agentid].sample() for agentid in agent_turn]
         
         obs, rewards, done, truncated, info = self.env.step(actions)
 
         self.assertEqual(len(obs), self.env.num_agents)
         self.assertEqual(len(info), self.env.num_agents)
 
-        for io, o in enumerate(obs):
-            self.assertTrue(self.env.observation_spaces[io].contains(o))
+        for space, o in zip(self.env.observation_spaces, obs):
+            self.assertTrue(space.contains(o))
+
+class CustomResetMessage(ResetMessage):
+    pass
 
 class ServerTestMixin:
     timeout = 1
     env_constructor = None
     actions = None
+    server_kwargs = {}
+    # the info expected with the interrupt message, if known
+    interrupt_info = None
 
     def setUp(self):
         self.multiagent_env = self.env_constructor()
-        self.server = MultiAgentServer(self.multiagent_env)
+        self.server = MultiAgentServer(self.multiagent_env, **self.server_kwargs)
         self.assertFalse(self.server.csi.finished_event.is_set())
         self.server.start()
         self.assertTrue(self.server.is_running())
@@ -77,16 +101,38 @@ class ServerTestMixin:
 
     def tearDown(self):
         self.server.stop()
-        self.assertTrue(self.server.csi.finished_event.is_set())
+        self.assertTrue(self.server.csi.finished_event.wait(timeout=1))
         self.multiagent_env.close()
 
+    def expect_obs_msg(self, agentid):
+        """
+        Gets the next message sent to the agent, checks that it is
+        an ObservationMessage and returns it.
+        """
+        obs_msg = self.server.csi.outgoing_messages[agentid].get(timeout=self.timeout)
+        self.assertIsInstance(obs_msg, ObservationMessage)
+        return obs_msg
+
     def test_start_and_stop(self):
         pass
     
+    def test_restart(self):
+        # the stop messages left in the queues must not reach the new run
+        self.server.stop()
+        self.server.start()
+        self.assertTrue(self.server.is_running())
+
+        self.server.csi.incoming_messages.put(ResetMessage(0))
+        self.expect_obs_msg(0)
+
     def test_reset(self):
         self.server.csi.incoming_messages.put(ResetMessage(0))
-        obs_msg = self.server.csi.outgoing_messages[0].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(0)
+
+    def test_message_subclass(self):
+        for _ in range(2):
+            self.server.csi.incoming_messages.put(CustomResetMessage(0))
+            self.expect_obs_msg(0)
 
     def test_action_before_reset(self):
         self.server.csi.incoming_messages.put(ActionMessage(self.actions[0], 0))
@@ -99,86 +145,87 @@ class ServerTestMixin:
         self.server.csi.incoming_messages.put(ResetMessage(0))
         self.server.csi.incoming_messages.put(ResetMessage(1))
 
-        obs_msg = self.server.csi.outgoing_messages[0].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(0)
 
         self.server.csi.incoming_messages.put(ActionMessage(self.actions[0], 0))
-        obs_msg = self.server.csi.outgoing_messages[1].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(1)
 
         self.server.csi.incoming_messages.put(ActionMessage(self.actions[1], 1))
-        obs_msg = self.server.csi.outgoing_messages[0].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(0)
 
     def test_transition2(self):
         self.server.csi.incoming_messages.put(ResetMessage(0))
-        obs_msg = self.server.csi.outgoing_messages[0].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(0)
         self.server.csi.incoming_messages.put(ActionMessage(self.actions[0], 0))
 
         self.server.csi.incoming_messages.put(ResetMessage(1))
-        obs_msg = self.server.csi.outgoing_messages[1].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(1)
 
         self.server.csi.incoming_messages.put(ActionMessage(self.actions[1], 1))
-        obs_msg = self.server.csi.outgoing_messages[0].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(0)
 
     def test_consecutive_resets(self):        
         self.server.csi.incoming_messages.put(ResetMessage(0))
-        obs_msg = self.server.csi.outgoing_messages[0].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(0)
 
         self.server.csi.incoming_messages.put(ResetMessage(1))
 
         self.server.csi.incoming_messages.put(ResetMessage(0))
-        obs_msg = self.server.csi.outgoing_messages[0].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(0)
 
         self.server.csi.incoming_messages.put(ActionMessage(self.actions[0], 0))
         # collect reset message
-        obs_msg = self.server.csi.outgoing_messages[1].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(1)
 
         self.server.csi.incoming_messages.put(ActionMessage(self.actions[1], 1))
-        obs_msg = self.server.csi.outgoing_messages[0].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(0)
 
     def test_consecutive_resets2(self):
         self.server.csi.incoming_messages.put(ResetMessage(0))
-        obs_msg = self.server.csi.outgoing_messages[0].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(0)
 
         self.server.csi.incoming_messages.put(ResetMessage(1))
 
         self.server.csi.incoming_messages.put(ResetMessage(0))
-        obs_msg = self.server.csi.outgoing_messages[0].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(0)
 
         self.server.csi.incoming_messages.put(ActionMessage(self.actions[0], 0))
         obs_msg = self.server.csi.outgoing_messages[1].get(timeout=self.timeout)
 
         self.server.csi.incoming_messages.put(ActionMessage(self.actions[1], 1))
-        obs_msg = self.server.csi.outgoing_messages[0].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(0)
 
     def test_consecutive_resets3(self):
         self.server.csi.incoming_messages.put(ResetMessage(0))
-        obs_msg = self.server.csi.outgoing_messages[0].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(0)
 
         self.server.csi.incoming_messages.put(ResetMessage(0))
-        obs_msg = self.server.csi.outgoing_messages[0].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(0)
 
         self.server.csi.incoming_messages.put(ResetMessage(1))
         self.server.csi.incoming_messages.put(ActionMessage(self.actions[0], 0))
-        obs_msg = self.server.csi.outgoing_messages[1].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(1)
 
         self.server.csi.incoming_messages.put(ActionMessage(self.actions[1], 1))
-        obs_msg = self.server.csi.outgoing_messages[0].get(timeout=self.timeout)
-        self.assertIsInstance(obs_msg, ObservationMessage)
+        self.expect_obs_msg(0)
+
+    def test_interrupt(self):
+        self.server.csi.incoming_messages.put(ResetMessage(0))
+        self.server.csi.incoming_messages.put(ResetMessage(1))
+        self.expect_obs_msg(0)
+
+        self.server.csi.incoming_messages.put(ActionMessage(self.actions[0], 0))
+        self.expect_obs_msg(1)
+
+        # agent 1 interrupts the episode: agent 0 is told that it ended
+        self.server.csi.incoming_messages.put(ResetMessage(1))
+        obs_msg = self.expect_obs_msg(0)
+        self.assertTrue(obs_msg.terminated)
+        self.assertTrue(obs_msg.truncated)
+        self.assertTrue(obs_msg.info['interrupted'])
+
+        if not self.interrupt_info is None:
+            self.assertEqual(obs_msg.info, self.interrupt_info)
 
 class ServerDeleteTestMixin:
     env_constructor = None
@@ -195,27 +242,56 @@ class ServerDeleteTestMixin:
         self.server.stop()
         del self.server
         gc.collect()
-        self.assertTrue(finished_event.is_set())
+        self.assertTrue(finished_event.wait(timeout=1))
 
 class ClientTestMixin:
     env_constructor = None
     actions = None
+    client_kwargs = {}
+
+    @classmethod
+    def setUpClass(cls):
+        # the agents block on each other: one worker for each
+        cls.executor = ThreadPoolExecutor(max_workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+
+    def run_agents(self, *agents):
+        """
+        Runs the agents concurrently and waits for all of them; errors,
+        including failed assertions, are re-raised in the test's thread.
+        """
+        run_concurrently(self.executor, agents, self.clients[0].csi.stop)
 
     def setUp(self):
         self.multiagent_env = self.env_constructor()
         self.clients, server = multi_agent_to_single_agent(
-            self.multiagent_env, return_server=True
+            self.multiagent_env, return_server=True, **self.client_kwargs
         )
         self.finished_event = server.csi.finished_event
         
     def tearDown(self):
-        del self.clients
-        gc.collect()
-        self.assertTrue(self.finished_event.is_set())
+        for client in self.clients: client.close()
+        self.assertTrue(self.finished_event.wait(timeout=1))
 
     def testStartStop(self):
         pass
 
+    def testDel(self):
+        # the clients stop the server once they are garbage collected
+        clients, self.clients = self.clients, []
+        del clients
+        gc.collect()
+        self.assertTrue(self.finished_event.wait(timeout=1))
+
+    def testCollectRunning(self):
+        # only the clients reference the server: its thread keeps it alive
+        gc.collect()
+        self.assertFalse(self.finished_event.is_set())
+        self.assertIsNotNone(self.clients[0].reset())
+
     def testRun(self):
         self.agent0_done = False
         self.agent1_done = False
@@ -250,14 +326,7 @@ class ClientTestMixin:
             self.assertFalse(any_obs_none)
             self.agent1_done = True
 
-        thread0 = Thread(target=weakref.proxy(agent0))
-        thread1 = Thread(target=weakref.proxy(agent1))
-
-        thread0.start()
-        thread1.start()
-
-        thread0.join()
-        thread1.join()
+        self.run_agents(agent0, agent1)
 
         self.assertTrue(self.agent0_done)
         self.assertTrue(self.agent1_done)
@@ -316,14 +385,7 @@ class IllegalActionTestMixin(ClientTestMixin):
             self.assertTrue(done)
             self.agent1_done = True
 
-        thread0 = Thread(target=weakref.proxy(agent0))
-        thread1 = Thread(target=weakref.proxy(agent1))
-
-        thread0.start()
-        thread1.start()
-
-        thread0.join()
-        thread1.join()
+        self.run_agents(agent0, agent1)
 
         self.assertTrue(self.agent0_done)
         self.assertTrue(self.agent1_done)
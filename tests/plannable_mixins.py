@@ -1,5 +1,5 @@
-import gc
 import numbers
+import itertools
 from gym_plannable.plannable import PlannableState
 from gym_plannable.agent import LegalAgent
 from gym_plannable.multi_agent import (
@@ -14,7 +14,7 @@ class PlannableInterfaceTestMixin:
         self.plannable_env = self.env_constructor()
 
     def tearDown(self):
-        del self.plannable_env
+        self.plannable_env.close()
 
     def testHasPlannableState(self):
         state = self.plannable_env.plannable_state()
@@ -73,10 +73,9 @@ class PlannableInterfaceTestMixin:
         state = state.init()
         self.assertIsInstance(state, PlannableState)
 
-        for istate, (state, prob) in enumerate(state.all_init()):
-            if istate >= self.max_next: break
+        for state, prob in itertools.islice(state.all_init(), self.max_next):
             self.assertIsInstance(state, PlannableState)
-            self.assertIsInstance(prob, numbers.Number)        
+            self.assertIsInstance(prob, numbers.Number)
     
     def testNext(self):
         self.plannable_env.reset()
@@ -86,11 +85,22 @@ class PlannableInterfaceTestMixin:
         next_state = state.next(actions)
         self.assertIsInstance(next_state, PlannableState)
 
-        for istate, (state, prob) in enumerate(state.all_next(actions)):
-            if istate >= self.max_next: break
+        for state, prob in itertools.islice(state.all_next(actions), self.max_next):
             self.assertIsInstance(state, PlannableState)
             self.assertIsInstance(prob, numbers.Number)
 
+    def testNextBatch(self):
+        self.plannable_env.reset()
+        state = self.plannable_env.plannable_state()
+        legals = state.legal_actions()
+        actions = [legals[a][0] for a in state.agent_turn]
+
+        next_states = state.next_batch([actions] * 3)
+        self.assertEqual(len(next_states), 3)
+
+        for next_state in next_states:
+            self.assertIsInstance(next_state, PlannableState)
+
     def testIsDoneNotBool(self):
         # to avoid silent errors, is_done is supposed to return 
         # a sequence that is not convertible to bool
@@ -111,9 +121,8 @@ class MultiAgentPlannableEnvTestMixin:
         self.finished_event = server.csi.finished_event
 
     def tearDown(self):
-        del self.clients
-        gc.collect()
-        self.assertTrue(self.finished_event.is_set())
+        for client in self.clients: client.close()
+        self.assertTrue(self.finished_event.wait(timeout=1))
 
     def testStartStop(self):
         pass
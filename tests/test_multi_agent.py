@@ -1,13 +1,24 @@
 import unittest
-from gym_plannable.multi_agent import StopServerException, multi_agent_to_single_agent
+from gym_plannable.multi_agent import (StopServerException, ObservationMessage,
+                                       ActionMessage, ResetMessage,
+                                       MultiAgentServer, SharedObservation,
+                                       SharedObservationBuffer,
+                                       multi_agent_to_single_agent)
+from gym_plannable.multi_agent.multi_agent_server import (ActionCollector,
+                                                         SyncActionCollector)
+from gym_plannable.multi_agent.common import reset_action
 from gym_plannable.env.tic_tac_toe import TicTacToeEnv
 from multi_agent_mixins import (ServerTestMixin, ServerDeleteTestMixin,
                                 ClientTestMixin, EnvTestMixin,
-                                ClientScoreTestMixin, IllegalActionTestMixin)
-from dummy_envs import DummyEnvTurnBased
+                                ClientScoreTestMixin, IllegalActionTestMixin,
+                                run_concurrently)
+from dummy_envs import DummyEnvTurnBased, DummyEnvCounting
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import itertools
 import weakref
-import gc
+import pickle
 
 class ServerTestTicTacToe(ServerTestMixin, unittest.TestCase):
     env_constructor = TicTacToeEnv
@@ -22,6 +33,13 @@ class ServerTestTicTacToe(ServerTestMixin, unittest.TestCase):
 class ServerTestDummyEnv(ServerTestMixin, unittest.TestCase):
     env_constructor = DummyEnvTurnBased
     actions = [0, 1, 2, 3, 0, 1, 2, 3]
+    interrupt_info = {'interrupted': True}
+
+class ServerTestDummyEnvInProcess(ServerTestMixin, unittest.TestCase):
+    env_constructor = DummyEnvTurnBased
+    actions = [0, 1, 2, 3, 0, 1, 2, 3]
+    server_kwargs = dict(in_process=True)
+    interrupt_info = {'interrupted': True}
 
 class ServerDeleteTestTicTacToe(ServerDeleteTestMixin, unittest.TestCase):
     env_constructor = TicTacToeEnv
@@ -47,6 +65,93 @@ class ClientTestTicTacToe(ClientTestMixin, unittest.TestCase):
         [2, 0]
     ]
 
+class ClientTestTicTacToeSharedObs(ClientScoreTestMixin, unittest.TestCase):
+    env_constructor = TicTacToeEnv
+    actions = [
+        [0, 0],
+        [0, 1],
+        [1, 0],
+        [1, 1],
+        [2, 0]
+    ]
+    scores = [1, -1]
+    client_kwargs = dict(in_process=False, shared_observations=True)
+
+    final_board = [
+        [0, 1, -1],
+        [0, 1, -1],
+        [0, -1, -1]
+    ]
+
+    def testSharedObservation(self):
+        for agentid in range(2):
+            self.assertIsInstance(self.clients[agentid].csi.shared_observations[agentid],
+                                  SharedObservationBuffer)
+
+        final_obs = [None, None]
+
+        def agent(agentid):
+            env = self.clients[agentid]
+            obs, info = env.reset()
+            self.assertEqual(obs.shape, env.observation_space.shape)
+
+            for a in self.actions[agentid::2]:
+                obs, rew, terminated, truncated, info = env.step(a)
+                if terminated or truncated: break
+
+            final_obs[agentid] = obs
+
+        self.run_agents(lambda: agent(0), lambda: agent(1))
+
+        for obs in final_obs:
+            np.testing.assert_array_equal(obs, self.final_board)
+
+class SharedObservationTest(unittest.TestCase):
+    timeout = 1
+
+    def setUp(self):
+        self.multiagent_env = TicTacToeEnv()
+        self.server = MultiAgentServer(self.multiagent_env, shared_observations=True)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testMessages(self):
+        csi = self.server.csi
+        csi.incoming_messages.put(ResetMessage(0))
+        csi.incoming_messages.put(ResetMessage(1))
+
+        obs_msg = csi.outgoing_messages[0].get(timeout=self.timeout)
+        self.assertIsInstance(obs_msg.observation, SharedObservation)
+        np.testing.assert_array_equal(csi.shared_observations[0].read(),
+                                      np.full((3, 3), -1))
+
+        csi.incoming_messages.put(ActionMessage([1, 1], 0))
+        obs_msg = csi.outgoing_messages[1].get(timeout=self.timeout)
+        self.assertIsInstance(obs_msg.observation, SharedObservation)
+
+        obs = csi.shared_observations[1].read()
+        self.assertEqual(obs[1, 1], 0)
+        self.assertEqual((obs == -1).sum(), 8)
+
+    def testFallback(self):
+        buffer = self.server.csi.shared_observations[0]
+        # observations that do not fit the buffer are sent as they are
+        for obs in [np.zeros((2, 2), dtype=buffer.dtype),
+                    np.zeros((3, 3), dtype=np.float32),
+                    [[0, 0, 0]] * 3, None]:
+            self.assertIs(buffer.write(obs), obs)
+
+    def testInProcess(self):
+        with self.assertRaises(ValueError):
+            MultiAgentServer(self.multiagent_env, in_process=True,
+                             shared_observations=True)
+
+        with self.assertRaises(ValueError):
+            multi_agent_to_single_agent(self.multiagent_env,
+                                        shared_observations=True)
+
 class ClientTestDummyEnv(ClientTestMixin, unittest.TestCase):
     env_constructor = DummyEnvTurnBased
     actions = [0, 1, 2, 3, 0, 1, 2, 3]
@@ -67,9 +172,8 @@ class ClientExceptionSafeTest(unittest.TestCase):
         self.finished_event = server.csi.finished_event
 
     def tearDown(self):
-        del self.clients
-        gc.collect()
-        self.assertTrue(self.finished_event.is_set())
+        for client in self.clients: client.close()
+        self.assertTrue(self.finished_event.wait(timeout=1))
 
     def testExceptionSafe(self):
         self.agent0_done = False
@@ -109,8 +213,8 @@ class ClientExceptionSafeTest(unittest.TestCase):
 
             self.agent1_done = True
 
-        thread0 = Thread(target=weakref.proxy(agent0))
-        thread1 = Thread(target=weakref.proxy(agent1))
+        thread0 = Thread(target=agent0)
+        thread1 = Thread(target=agent1)
 
         thread0.start()
         thread1.start()
@@ -121,6 +225,187 @@ class ClientExceptionSafeTest(unittest.TestCase):
         self.assertTrue(self.agent0_done)
         self.assertTrue(self.agent1_done)
 
+class ActionCollectorTest(unittest.TestCase):
+    def testAllAgents(self):
+        collector = ActionCollector(3, [0, 1, 2])
+        self.assertEqual(list(collector.agent_turn), [0, 1, 2])
+
+        collector.collect(ActionMessage('a', 2))
+        collector.collect(ActionMessage('b', 0))
+        self.assertFalse(collector.all_collected)
+
+        with self.assertRaises(RuntimeError):
+            collector.get_actions()
+
+        with self.assertRaises(ValueError):
+            collector.collect(ActionMessage('c', 2))
+
+        with self.assertRaises(ValueError):
+            collector.collect(ActionMessage('c', 3))
+
+        collector.collect(ActionMessage('c', 1))
+        self.assertTrue(collector.all_collected)
+        self.assertEqual(list(collector.get_actions()), ['b', 'c', 'a'])
+
+    def testActionsKept(self):
+        # the returned list is not cleared by the next reset
+        collector = ActionCollector(2, [0, 1])
+        collector.collect(ActionMessage('a', 0))
+        collector.collect(ActionMessage('b', 1))
+        actions = collector.get_actions()
+        collector.reset([0, 1])
+        self.assertEqual(actions, ['a', 'b'])
+
+    def testSomeAgents(self):
+        collector = ActionCollector(3, [2, 0])
+        self.assertEqual(list(collector.agent_turn), [2, 0])
+
+        with self.assertRaises(ValueError):
+            collector.collect(ActionMessage('a', 1))
+
+        collector.collect(ActionMessage('a', 0))
+
+        with self.assertRaises(ValueError):
+            collector.collect(ActionMessage('b', 0))
+
+        collector.collect(ActionMessage('b', 2))
+        self.assertTrue(collector.all_collected)
+        self.assertEqual(list(collector.get_actions()), ['b', 'a'])
+
+    def testRequestedReset(self):
+        for agentids in [[0, 1], [1]]:
+            collector = ActionCollector(2, agentids)
+            self.assertFalse(collector.requested_reset(1))
+
+            collector.collect(ResetMessage(1))
+            self.assertTrue(collector.requested_reset(1))
+            self.assertFalse(collector.requested_reset(0))
+            self.assertTrue(collector.interrupted)
+            self.assertEqual(collector.reset_requesters, {1})
+            if collector.all_collected:
+                self.assertIs(collector.get_actions()[-1], reset_action)
+
+            collector.reset(agentids)
+            self.assertFalse(collector.requested_reset(1))
+            self.assertFalse(collector.interrupted)
+            self.assertEqual(collector.reset_requesters, set())
+
+    def testSynchronous(self):
+        collector = SyncActionCollector(2, [1])
+        # everybody is collected from, the env only expects agent 1
+        self.assertEqual(list(collector.agent_turn), [0, 1])
+
+        with self.assertRaises(ValueError):
+            collector.collect(ActionMessage('a', 0))
+
+        collector.collect(ActionMessage('a', 1))
+        self.assertFalse(collector.all_collected)
+
+        collector.collect(ResetMessage(0))
+        self.assertTrue(collector.all_collected)
+        self.assertTrue(collector.requested_reset(0))
+
+        collector.reset([0])
+        self.assertFalse(collector.interrupted)
+        collector.collect(ActionMessage('b', 0))
+
+        with self.assertRaises(ValueError):
+            collector.collect(ActionMessage('b', 1))
+
+class ObservationMessageTest(unittest.TestCase):
+    def testPickle(self):
+        msg = ObservationMessage(np.arange(6).reshape(2, 3), 1.5, True, False,
+                                 {'key': 'value'})
+
+        for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(msg, protocol=protocol))
+            self.assertIs(type(copy), ObservationMessage)
+            np.testing.assert_array_equal(copy.observation, msg.observation)
+            self.assertEqual(copy.totuple()[1:], msg.totuple()[1:])
+
+    def testFromLegacy(self):
+        msg = ObservationMessage.from_legacy(0, 1, True, {})
+        self.assertEqual(msg.totuple(), (0, 1, True, False, {}))
+
+        info = {'TimeLimit.truncated': True}
+        msg = ObservationMessage.from_legacy(0, 1, True, info)
+        self.assertEqual(msg.totuple(), (0, 1, False, True, info))
+
+    def testPickleMessages(self):
+        for msg in [ActionMessage([1, 2], 1), ResetMessage(1)]:
+            copy = pickle.loads(pickle.dumps(msg))
+            self.assertEqual((copy.agentid, getattr(copy, 'action', None)),
+                             (msg.agentid, getattr(msg, 'action', None)))
+
+class ClientMessageReuseTest(unittest.TestCase):
+    """
+    Runs several episodes, some of them interrupted, in the in-process
+    mode, where the server reuses the messages consumed by the clients,
+    and checks that the agents see the same values as with the
+    multi-process queues, where no messages are reused.
+    """
+    num_episodes = 6
+
+    def run_episodes(self, in_process):
+        multiagent_env = DummyEnvCounting()
+        clients, server = multi_agent_to_single_agent(
+            multiagent_env, return_server=True, in_process=in_process
+        )
+        traces = [[], []]
+
+        def agent0():
+            env = clients[0]
+            for episode in range(self.num_episodes):
+                traces[0].append(env.reset())
+                while True:
+                    ret = env.step(episode % 4)
+                    traces[0].append(ret)
+                    if ret[2] or ret[3]: break
+
+        def agent1():
+            env = clients[1]
+            traces[1].append(env.reset())
+            last_episode = self.num_episodes - 1
+
+            for episode in range(self.num_episodes):
+                for i in itertools.count():
+                    # interrupt every other episode: the reset also
+                    # starts the next episode
+                    if episode % 2 and i == 1 and episode < last_episode:
+                        traces[1].append(env.reset())
+                        break
+
+                    ret = env.step(i % 4)
+                    traces[1].append(ret)
+
+                    if ret[2] or ret[3]:
+                        if episode < last_episode:
+                            traces[1].append(env.reset())
+                        break
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            run_concurrently(executor, [agent0, agent1], server.stop)
+
+        server.stop()
+        return traces
+
+    def testMessageReuse(self):
+        traces = self.run_episodes(in_process=True)
+        self.assertEqual(traces, self.run_episodes(in_process=False))
+
+        # agent 0 is the one told about the interrupts
+        self.assertTrue(any(len(ret) == 5 and ret[4].get('interrupted')
+                            for ret in traces[0]))
+
+        for agentid, trace in enumerate(traces):
+            steps = [ret for ret in trace if len(ret) == 5]
+
+            for obs, rew, terminated, truncated, info in steps:
+                if info.get('interrupted'): continue
+                self.assertEqual(info['agentid'], agentid)
+                self.assertEqual(obs, info['step'])
+                self.assertEqual(rew, 10 * info['step'] + agentid)
+
 class ClientScoreTestTicTacToe(ClientScoreTestMixin, unittest.TestCase):
     env_constructor = TicTacToeEnv
     actions = [
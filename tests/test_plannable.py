@@ -1,5 +1,7 @@
 import unittest
+import numpy as np
 from gym_plannable.env.tic_tac_toe import TicTacToeEnv
+from gym_plannable.score_tracker import ScoreTrackerTotal
 from plannable_mixins import PlannableInterfaceTestMixin, MultiAgentPlannableEnvTestMixin
 
 class PlannableInterfaceTestTicTacToe(PlannableInterfaceTestMixin, unittest.TestCase):
@@ -8,3 +10,103 @@ class PlannableInterfaceTestTicTacToe(PlannableInterfaceTestMixin, unittest.Test
 
 class PlannableEnvTestTicTacToe(MultiAgentPlannableEnvTestMixin, unittest.TestCase):
     env_constructor = TicTacToeEnv
+
+class ScoreTrackerTotalTest(unittest.TestCase):
+    def testPreallocated(self):
+        tracker = ScoreTrackerTotal(2)
+        scores = tracker.scores
+        np.testing.assert_array_equal(scores, [0, 0])
+
+        tracker.update_scores([1, -1])
+        tracker.update_scores(np.array([1, 0]))
+        # updated in place
+        self.assertIs(tracker.scores, scores)
+        np.testing.assert_array_equal(tracker.scores, [2, -1])
+
+    def testLazy(self):
+        tracker = ScoreTrackerTotal()
+        self.assertEqual(tracker.scores, 0)
+
+        tracker.update_scores([1, -1])
+        tracker.update_scores([1, 0])
+        np.testing.assert_array_equal(tracker.scores, [2, -1])
+
+class LegalActionsCacheTest(unittest.TestCase):
+    def testCache(self):
+        state = TicTacToeEnv().plannable_state()
+        legal = state.legal_actions()
+        self.assertIs(state.legal_actions()[0], legal[0])
+        self.assertEqual(len(legal[0]), 9)
+
+        # changing the returned list does not change the cache
+        legal[0] = legal[0][:1]
+        self.assertEqual(len(state.legal_actions()[0]), 9)
+        legal = state.legal_actions()
+
+        # copies do not share the cache
+        next_state = state.next([(0, 0)])
+        self.assertIs(state.legal_actions()[0], legal[0])
+        self.assertEqual(len(next_state.legal_actions()[0]), 8)
+
+        # nor do states modified in place
+        state.next([(1, 1)], inplace=True)
+        self.assertEqual(len(state.legal_actions()[0]), 8)
+        self.assertEqual(len(state.init().legal_actions()[0]), 9)
+
+        for ns, prob in state.all_next([(0, 0)]):
+            self.assertEqual(len(ns.legal_actions()[0]), 7)
+
+class StateKeyTest(unittest.TestCase):
+    def testTicTacToe(self):
+        state = TicTacToeEnv().plannable_state()
+        # the same position reached by different move orders
+        s1 = state.next([(0, 0)]).next([(1, 1)]).next([(0, 1)])
+        s2 = state.next([(0, 1)]).next([(1, 1)]).next([(0, 0)])
+        s3 = state.next([(0, 1)]).next([(1, 1)]).next([(0, 2)])
+
+        self.assertEqual(s1, s2)
+        self.assertEqual(hash(s1), hash(s2))
+        self.assertNotEqual(s1, s3)
+        self.assertEqual(len({s1, s2, s3}), 2)
+        self.assertNotEqual(state, state.next([(0, 0)]))
+
+class AllNextBatchTest(unittest.TestCase):
+    def testTicTacToe(self):
+        state = TicTacToeEnv().plannable_state()
+        # player 0 wins with (0, 2)
+        for action in [(0, 0), (1, 0), (0, 1), (1, 1)]:
+            state = state.next([action])
+
+        states, probs, rewards, done = state.all_next_batch([(0, 2)])
+        self.assertEqual(len(states), 1)
+        np.testing.assert_array_equal(probs, [1.0])
+        np.testing.assert_array_equal(rewards, [[1, -1]])
+        np.testing.assert_array_equal(done, [[True, True]])
+        self.assertEqual(rewards.shape, (1, state.num_agents))
+
+class SelectWhoTest(unittest.TestCase):
+    def testTurn(self):
+        state = TicTacToeEnv().plannable_state().next([(0, 0)])
+        # arrays and lists select the same items
+        np.testing.assert_array_equal(state.rewards('turn'), [state.rewards()[1]])
+        np.testing.assert_array_equal(state.scores('turn'), [state.scores()[1]])
+        self.assertEqual(len(state.legal_actions('turn')), 1)
+        self.assertEqual(state.is_done('turn').tolist(), [False])
+
+class AllNextScoresTest(unittest.TestCase):
+    def setUp(self):
+        self.state = TicTacToeEnv().plannable_state()
+        # player 0 wins with (0, 2)
+        for action in [(0, 0), (1, 0), (0, 1), (1, 1)]:
+            self.state = self.state.next([action])
+
+    def testTracked(self):
+        # the scores are the same as after next(), counted once
+        expected = self.state.next([(0, 2)]).scores()
+        for ns, prob in self.state.all_next([(0, 2)]):
+            np.testing.assert_array_equal(ns.scores(), expected)
+
+    def testUntracked(self):
+        for ns, prob in self.state.all_next([(0, 2)], track_scores=False):
+            np.testing.assert_array_equal(ns.scores(), self.state.scores())
+            np.testing.assert_array_equal(ns.rewards(), [1, -1])